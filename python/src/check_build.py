@@ -0,0 +1,16 @@
+import importlib.util
+
+import main
+
+
+# Run after setup.py build_ext: main must resolve to the compiled extension
+# and serve the same API as the source it was built from.
+assert main.__file__.endswith(".so"), main.__file__
+
+spec = importlib.util.spec_from_file_location("main_source", "main.py")
+main_source = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main_source)
+
+assert main.app.openapi() == main_source.app.openapi(), (
+    "the compiled main serves a different OpenAPI schema than main.py"
+)
@@ -1,23 +1,39 @@
+import asyncio
 from datetime import datetime, time, timedelta
 from enum import Enum
+from functools import lru_cache, wraps
 from typing import List, Set
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
 from fastapi import (
-    Body, Cookie, FastAPI, Form, Header, Path, Query, status, File, UploadFile,
-    HTTPException, Request,
+    APIRouter, Body, Cookie, Depends, FastAPI, Form, Header, Path, Query, status,
+    File, UploadFile, HTTPException, Request,
 )
+from fastapi import params
+from fastapi.dependencies import utils as dependencies_utils
 from fastapi.encoders import jsonable_encoder
 from fastapi.exception_handlers import (
     http_exception_handler,
     request_validation_exception_handler,
 )
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import (
+    JSONResponse, ORJSONResponse, PlainTextResponse, Response,
+)
+from fastapi.routing import APIRoute
+
+from blake3 import blake3
+import msgpack
+import orjson
+import re2
 
-from pydantic import BaseModel, EmailStr, Field, HttpUrl
+from pydantic import BaseModel, ConstrainedStr, Field, HttpUrl
 
+from starlette.datastructures import URL
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import RedirectResponse
+from starlette.routing import Match
 
 
 class UnicornException(Exception):
@@ -25,6 +41,23 @@ class UnicornException(Exception):
         self.item_id = item_id
 
 
+class Digits(ConstrainedStr):
+    # re2 matches in linear time, unlike the backtracking re module.
+    regex = re2.compile("^[0-9]*$")
+
+
+class ShortLetters(ConstrainedStr):
+    min_length = 2
+    max_length = 5
+    regex = re2.compile("^[a-zA-Z]*$")
+
+
+class Email(ConstrainedStr):
+    # A shape check only, EmailStr runs the much slower email-validator.
+    max_length = 254
+    regex = re2.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
 class ModelName(str, Enum):
     alexnet = "alexnet"
     resnet = "resnet"
@@ -68,6 +101,16 @@ class Item(BaseModel):
             }
         }
 
+    def _to_dict(self):
+        # Shallow copy instead of .dict(), which walks every field recursively.
+        item_dict = self.__dict__.copy()
+        item_dict["keks"] = list(self.keks)
+        if self.images is not None:
+            item_dict["images"] = [image.__dict__ for image in self.images]
+        if self.tax:
+            item_dict["price_with_tax"] = self.price + self.tax
+        return item_dict
+
 
 class Offer(BaseModel):
     name: str = Field(..., example="Foo")
@@ -87,7 +130,242 @@ class Tags(Enum):
     users = "users"
 
 
-app = FastAPI()
+class MsgPackResponse(Response):
+    media_type = "application/x-msgpack"
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def timedelta_default(obj):
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    raise TypeError
+
+
+class TimedeltaORJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content,
+            default=timedelta_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+
+# Negotiated responses depend on Accept, caches must key on it too.
+negotiated_headers = {"Vary": "Accept"}
+
+negotiated_responses = {200: {"content": {MsgPackResponse.media_type: {}}}}
+
+
+def accept_quality(accept: str, media_type: str) -> tuple[float, int]:
+    """
+    Return the q-value the Accept header gives media_type, with how specific
+    the matching range was: 2 for the exact type, 1 for type/*, 0 for */*.
+    """
+    main_type = media_type.split("/")[0]
+    quality, specificity = 0.0, -1
+    for media_range in accept.split(","):
+        range_type, *params = media_range.split(";")
+        range_type = range_type.strip().lower()
+        if range_type == media_type:
+            level = 2
+        elif range_type == f"{main_type}/*":
+            level = 1
+        elif range_type == "*/*":
+            level = 0
+        else:
+            continue
+        if level <= specificity:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+                if not 0 <= q <= 1:  # also rejects inf and nan
+                    q = 0.0
+        quality, specificity = q, level
+    return quality, specificity
+
+
+async def negotiate_response(request: Request) -> type[Response]:
+    accept = request.headers.get("accept", "*/*")
+    msgpack_quality = accept_quality(accept, MsgPackResponse.media_type)
+    json_quality = accept_quality(accept, ORJSONResponse.media_type)
+    if msgpack_quality[0] <= 0:
+        return ORJSONResponse
+    # Naming msgpack explicitly wins a tie with an equally weighted JSON.
+    if msgpack_quality[0] > json_quality[0] or (
+        msgpack_quality[0] == json_quality[0] and msgpack_quality[1] == 2
+    ):
+        return MsgPackResponse
+    return ORJSONResponse
+
+
+class ORJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """
+    Parses JSON request bodies with orjson instead of the stdlib json module.
+    orjson.JSONDecodeError subclasses json.JSONDecodeError, so malformed bodies
+    still get FastAPI's jsondecode 422, though with orjson's message text.
+    orjson is also stricter: NaN and Infinity, which stdlib json accepts, are
+    rejected as malformed.
+    """
+
+    def __init__(self, path: str, endpoint, *, name: str | None = None, **kwargs):
+        # Starlette only reads __name__ from plain functions. Endpoints compiled
+        # by Cython are cyfunctions and would all be named after their type.
+        super().__init__(path, endpoint, name=name or endpoint.__name__, **kwargs)
+
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+        # Form and File bodies (File subclasses Form) never call json().
+        if self.body_field is None or isinstance(
+            self.body_field.field_info, params.Form
+        ):
+            return route_handler
+
+        async def orjson_route_handler(request: Request):
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+
+def cache_per_callable(func):
+    cache = WeakKeyDictionary()
+
+    @wraps(func)
+    def wrapper(call):
+        try:
+            return cache[call]
+        except KeyError:
+            pass
+        except TypeError:  # not weak-referenceable, nothing to cache on
+            return func(call)
+        result = cache[call] = func(call)
+        return result
+
+    return wrapper
+
+
+# Endpoints and dependencies never change after startup, but FastAPI inspects
+# them again on every request.
+for name in (
+    "get_typed_signature",
+    "is_async_gen_callable",
+    "is_coroutine_callable",
+    "is_gen_callable",
+):
+    setattr(dependencies_utils, name, cache_per_callable(getattr(dependencies_utils, name)))
+
+
+class RouteCacheRouter(APIRouter):
+    """
+    Remembers which route served each (method, path) of a route without path
+    parameters, so those requests skip the linear scan over all routes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.static_routes = {}
+
+    @classmethod
+    def adopt(cls, router: APIRouter) -> "RouteCacheRouter":
+        # FastAPI builds its APIRouter itself and has no option for the class.
+        router.__class__ = cls
+        router.static_routes = {}
+        return router
+
+    def add_api_route(self, *args, **kwargs):
+        self.static_routes.clear()
+        super().add_api_route(*args, **kwargs)
+
+    def add_route(self, *args, **kwargs):
+        self.static_routes.clear()
+        super().add_route(*args, **kwargs)
+
+    def mount(self, *args, **kwargs):
+        self.static_routes.clear()
+        super().mount(*args, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await super().__call__(scope, receive, send)
+
+        if "router" not in scope:
+            scope["router"] = self
+
+        key = (scope["method"], scope["path"])
+        route = self.static_routes.get(key)
+        if route is not None:
+            _, child_scope = route.matches(scope)
+            scope.update(child_scope)
+            await route.handle(scope, receive, send)
+            return
+
+        # The same scan as Router.__call__, remembering static full matches.
+        partial = None
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                if getattr(route, "param_convertors", None) == {}:
+                    self.static_routes[key] = route
+                scope.update(child_scope)
+                await route.handle(scope, receive, send)
+                return
+            elif match == Match.PARTIAL and partial is None:
+                partial = route
+                partial_scope = child_scope
+
+        if partial is not None:
+            scope.update(partial_scope)
+            await partial.handle(scope, receive, send)
+            return
+
+        if self.redirect_slashes and scope["path"] != "/":
+            redirect_scope = dict(scope)
+            if scope["path"].endswith("/"):
+                redirect_scope["path"] = redirect_scope["path"].rstrip("/")
+            else:
+                redirect_scope["path"] = redirect_scope["path"] + "/"
+
+            for route in self.routes:
+                match, _ = route.matches(redirect_scope)
+                if match != Match.NONE:
+                    redirect_url = URL(scope=redirect_scope)
+                    response = RedirectResponse(url=str(redirect_url))
+                    await response(scope, receive, send)
+                    return
+
+        await self.default(scope, receive, send)
+
+
+class RouteCacheFastAPI(FastAPI):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        RouteCacheRouter.adopt(self.router)
+        self.openapi_routes_seen = len(self.routes)
+
+    def openapi(self):
+        # FastAPI builds the schema once, rebuild it only if routes were added.
+        if self.openapi_routes_seen != len(self.routes):
+            self.openapi_schema = None
+            self.openapi_routes_seen = len(self.routes)
+        return super().openapi()
+
+
+app = RouteCacheFastAPI(default_response_class=ORJSONResponse)
+app.router.route_class = ORJSONRoute
 
 
 @app.exception_handler(UnicornException)
@@ -122,20 +400,28 @@ async def validation_exception_handler(request, exc):
     return await request_validation_exception_handler(request, exc)
 
 
+root_body = orjson.dumps({"message": "Hello World"})
+
+long_description = "This is an amazing item that has a long description"
+
+
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
+    return Response(content=root_body, media_type="application/json")
 
 
-@app.get("/models/{model_name}")
-async def get_model(model_name: ModelName):
-    if model_name == ModelName.alexnet:
-        return {"model_name": model_name, "message": "Deep Learning FTW!"}
+model_messages = {
+    ModelName.alexnet: "Deep Learning FTW!",
+    ModelName.lenet: "LeCNN all the images",
+    ModelName.resnet: "Have some residuals",
+}
 
-    if model_name.value == "lenet":
-        return {"model_name": model_name, "message": "LeCNN all the images"}
 
-    return {"model_name": model_name, "message": "Have some residuals"}
+@app.get("/models/{model_name}")
+async def get_model(model_name: ModelName):
+    return ORJSONResponse(
+        content={"model_name": model_name.value, "message": model_messages[model_name]}
+    )
 
 
 @app.get("/files/{file_path:path}")
@@ -145,9 +431,34 @@ async def read_file(file_path: str):
 
 fake_items_db = [{"item_name": "Foo"}, {"item_name": "Bar"}, {"item_name": "Baz"}]
 
-@app.get("/items/", tags=Tags.items)
-async def read_items(skip: int = 0, limit: int = 10):
-    return fake_items_db[skip : skip + limit]
+
+# fake_items_db is never written to. If it is, rebuild fake_items_blobs and
+# call render_items.cache_clear().
+fake_items_blobs = {
+    response_class: [response_class(content=item).body for item in fake_items_db]
+    for response_class in (ORJSONResponse, MsgPackResponse)
+}
+
+
+@lru_cache(maxsize=128)
+def render_items(skip: int, limit: int, response_class: type[Response]) -> bytes:
+    blobs = fake_items_blobs[response_class][skip : skip + limit]
+    if response_class is MsgPackResponse:
+        return msgpack.Packer().pack_array_header(len(blobs)) + b"".join(blobs)
+    return b"[" + b",".join(blobs) + b"]"
+
+
+@app.get("/items/", tags=Tags.items, responses=negotiated_responses)
+async def read_items(
+    skip: int = 0,
+    limit: int = 10,
+    response_class: type[Response] = Depends(negotiate_response),
+):
+    return Response(
+        content=render_items(skip, limit, response_class),
+        media_type=response_class.media_type,
+        headers=negotiated_headers,
+    )
 
 @app.post(
     "/items/",
@@ -167,12 +478,10 @@ async def create_item(item: Item = Body(..., embed=True)):
     - **tags**: a set of unique tag strings for this item
     """
 
-    item_dict = item.dict()
-    if item.tax:
-        item_dict.update({
-            "price_with_tax": item.price + item.tax
-        })
-    return item_dict
+    return ORJSONResponse(
+        content=item._to_dict(),
+        status_code=status.HTTP_201_CREATED,
+    )
 
 @app.put("/items/{item_id}")
 async def update_item(
@@ -182,17 +491,17 @@ async def update_item(
     return results
 
 
-@app.get("/item/{item_id}")
+@app.get("/item/{item_id}", responses=negotiated_responses)
 async def read_item(
     item_id: int = Path(..., title="The ID of the item to get", ge=10, lt=1000),
-    needy: List[str] = Query(
+    needy: List[Digits] = Query(
         ...,
         title="Querty string",
         description="Query string for the items to search in the database that have a good match",
-        alias="kek-lol",
-        regex="^[0-9]*$"),
-    q: str | None = Query(None, min_length=2, max_length=5, regex="^[a-zA-Z]*$"),
-    short: bool = False
+        alias="kek-lol"),
+    q: ShortLetters | None = Query(None),
+    short: bool = False,
+    response_class: type[Response] = Depends(negotiate_response),
 ):
     if item_id < 20:
         raise HTTPException(
@@ -204,32 +513,29 @@ async def read_item(
         raise UnicornException(item_id=item_id)
     item = {"item_id": item_id, "needy": needy}
     if q:
-        item.update({"q": q})
+        item["q"] = q
     if not short:
-        item.update(
-            {"description": "This is an amazing item that has a long description"}
-        )
-    return item
+        item["description"] = long_description
+    return response_class(content=item, headers=negotiated_headers)
 
 
-@app.get("/users/{user_id}/items/{item_id}")
+@app.get("/users/{user_id}/items/{item_id}", responses=negotiated_responses)
 async def read_user_item(
     user_id: int,
     item_id: str,
     q: str | None = None,
-    short: bool = False
+    short: bool = False,
+    response_class: type[Response] = Depends(negotiate_response),
 ):
     item = {"item_id": item_id, "owner_id": user_id}
     if q:
-        item.update({"q": q})
+        item["q"] = q
     if not short:
-        item.update(
-            {"description": "This is an amazing item that has a long description"}
-        )
-    return item
+        item["description"] = long_description
+    return response_class(content=item, headers=negotiated_headers)
 
 
-@app.put("/data/{data_id}")
+@app.put("/data/{data_id}", response_class=TimedeltaORJSONResponse)
 async def update_data(
     data_id: UUID,
     start_datetime: datetime | None = Body(None),
@@ -244,7 +550,7 @@ async def update_data(
 
     duration = (end_datetime or datetime.now()) - start_process
 
-    return {
+    return TimedeltaORJSONResponse(content={
         "data_id": data_id,
         "start_datetime": start_datetime,
         "end_datetime": end_datetime,
@@ -252,7 +558,7 @@ async def update_data(
         "process_after": process_after,
         "start_process": start_process,
         "duration": duration,
-    }
+    })
 
 
 @app.get("/ads/")
@@ -270,7 +576,7 @@ async def read_ads(
 
 class UserBase(BaseModel):
     username: str
-    email: EmailStr
+    email: Email
     full_name: str | None = None
 
 
@@ -287,20 +593,26 @@ class UserInDB(UserBase):
 
 
 def fake_password_hasher(raw_password: str):
-    return "supersecret" + raw_password
+    return blake3(b"supersecret" + raw_password.encode()).hexdigest()
 
 
 def fake_save_user(user_in: UserIn):
     hashed_password = fake_password_hasher(user_in.password)
-    user_in_db = UserInDB(**user_in.dict(), hashed_password=hashed_password)
+    # user_in is already validated, construct() skips the email check.
+    user_data = user_in.__dict__.copy()
+    del user_data["password"]
+    user_in_db = UserInDB.construct(**user_data, hashed_password=hashed_password)
     print("User saved! ..not really")
     return user_in_db
 
 
-@app.post("/user/", response_model=UserOut, tags=Tags.users)
+# UserOut is only documented, response_model would validate user_saved again.
+@app.post("/user/", responses={200: {"model": UserOut}}, tags=Tags.users)
 async def create_user(user_in: UserIn):
     user_saved = fake_save_user(user_in)
-    return user_saved
+    return ORJSONResponse(
+        content={name: user_saved.__dict__[name] for name in UserOut.__fields__}
+    )
 
 
 @app.post("/login/")
@@ -330,9 +642,17 @@ async def create_upload_file(
         return {"filename": file.filename}
 
 
+async def stream_len(file: UploadFile, chunk_size: int = 64 * 1024) -> int:
+    size = 0
+    while chunk := await file.read(chunk_size):
+        size += len(chunk)
+    return size
+
+
 @app.post("/files-multiple/")
-async def create_files_multiple(files: list[bytes] = File(...)):
-    return {"file_sizes": [len(file) for file in files]}
+async def create_files_multiple(files: list[UploadFile] = File(...)):
+    file_sizes = await asyncio.gather(*[stream_len(file) for file in files])
+    return {"file_sizes": file_sizes}
 
 
 @app.post("/uploadfiles-multiple/")
@@ -0,0 +1,17 @@
+from Cython.Build import cythonize
+from setuptools import setup
+
+
+# Builds main.*.so next to main.py, the extension module shadows the source
+# on import. Run: python setup.py build_ext --inplace
+setup(
+    name="main",
+    ext_modules=cythonize(
+        ["main.py"],
+        language_level=3,
+        # FastAPI inspects endpoint signatures, keep them introspectable, and
+        # parameter defaults like Body(...) must not be type checked against
+        # their annotations.
+        compiler_directives={"binding": True, "annotation_typing": False},
+    ),
+)